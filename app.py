@@ -3,23 +3,25 @@
 
 import os
 import time
-import json
-from datetime import datetime, timezone
-from flask import Flask, jsonify, render_template
+import orjson
+from datetime import datetime
+from flask import Flask, Response, render_template, request
 
 from scanners import DeviceStore, start_wifi_scanner, start_ble_scanner
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 
-# Shared in-memory store for both scanners
-store = DeviceStore(history_len=300)  # keep ~60 samples per device
-
-
 # Create logs directory & filename once at startup
 if not os.path.exists("logs"):
     os.makedirs("logs")
 log_start_time = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
-LOG_FILE = f"logs/{log_start_time}.json"
+LOG_FILE = f"logs/{log_start_time}.ndjson"  # one JSON observation per line
+
+# Shared in-memory store for both scanners
+store = DeviceStore(history_len=300, log_path=LOG_FILE)  # keep ~60 samples per device
+
+# Distinguishes ETags across restarts, when the store version starts over
+ETAG_EPOCH = format(int(time.time()), "x")
 
 # Kick off background scanners
 start_wifi_scanner(store, interval_sec=5)   # scan every ~5s
@@ -33,6 +35,11 @@ def index():
 
 @app.route("/api/devices")
 def api_devices():
+    # Read the version before the snapshot: a concurrent update can only make
+    # the ETag stale-low, which costs one extra full response, never a stale 304
+    etag = f"{ETAG_EPOCH}-{store.version}"
+    if request.if_none_match.contains_weak(etag):
+        return "", 304
     snapshot = store.snapshot()
     # Convert to JSON-safe payload
     out = []
@@ -43,29 +50,19 @@ def api_devices():
             "mac": d["mac"],
             "vendor": d.get("vendor") or "Unknown",
             "first_seen": d["first_seen"],
-            "first_seen_iso": datetime.fromtimestamp(d["first_seen"], tz=timezone.utc).astimezone().isoformat(),
+            "first_seen_iso": d["first_seen_iso"],
             "last_seen": d["last_seen"],
-            "last_seen_iso": datetime.fromtimestamp(d["last_seen"], tz=timezone.utc).astimezone().isoformat(),
+            "last_seen_iso": d["last_seen_iso"],
             "signal_dbm": d.get("rssi"),
-            "history": d.get("history", [])  # list of numbers (latest at end)
+            "history": d["history"]  # int8 numpy array (latest at end)
         })
-    return jsonify({"devices": out, "server_time": time.time()})
+    # orjson serializes the nested history lists far faster than stdlib json
+    body = orjson.dumps({"devices": out, "server_time": time.time()}, option=orjson.OPT_SERIALIZE_NUMPY)
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag, weak=True)
+    return resp
 
 
 if __name__ == "__main__":
-  
-    # Make sure logs directory exists
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
-
-    # Build filename based on start time
-    start_time = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
-    log_file = f"logs/{start_time}.json"
-
-    # Save initial snapshot
-    snapshot = store.snapshot()
-    with open(log_file, "w", encoding="utf-8") as f:
-        json.dump(snapshot, f, indent=2, ensure_ascii=False)
-  
     # Use Flask’s dev server for simplicity. For production, consider waitress/uvicorn+ASGI, etc.
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
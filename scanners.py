@@ -1,48 +1,136 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import os
+import string
+import struct
 import threading
 import time
-from collections import defaultdict, deque
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Dict, Optional, List
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, Optional, List, Tuple
+
+import numpy as np
+import orjson
+from sortedcontainers import SortedKeyList
 
 # ---- Optional vendor lookup ----
-_vendor_lock = threading.RLock()
-_vendor_cache: Dict[str, str] = {}
+# MacLookup.lookup drives its own event loop with run_until_complete, which
+# fails on the scanner loop thread (a loop is always running there). Lookups
+# are therefore handed to a dedicated thread that owns the MacLookup.
 try:
     from mac_vendor_lookup import MacLookup  # pip install mac-vendor-lookup
-    _mac_lookup = MacLookup()
+    _vendor_executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VendorLookup")
 except Exception:
-    _mac_lookup = None
+    MacLookup = None
+    _vendor_executor = None
+_mac_lookup = None  # created lazily on the VendorLookup thread
+
 
+# Upper-case and turn "-" separators into ":" in a single C-level pass
+_MAC_TRANS = bytes.maketrans(b"-" + string.ascii_lowercase.encode(), b":" + string.ascii_uppercase.encode())
+_MAC_SPLIT = struct.Struct("2s2s2s2s2s2s")
 
-def _normalize_mac(mac: str) -> str:
-    mac = (mac or "").strip().upper().replace("-", ":")
+
+def _normalize_mac(mac: str) -> Tuple[str, Optional[int]]:
+    """Return the normalized MAC and its 24-bit OUI (None if not a hex MAC)."""
+    b = (mac or "").encode("ascii", "ignore").translate(_MAC_TRANS).strip()
     # Ensure colon-separated 6-byte form if possible
-    if ":" not in mac and len(mac) == 12:
-        mac = ":".join(mac[i:i+2] for i in range(0, 12, 2))
-    return mac
-
-
-def _vendor_for(mac: str) -> Optional[str]:
-    mac = _normalize_mac(mac)
-    if not mac:
-        return None
-    prefix = ":".join(mac.split(":")[:3])
-    with _vendor_lock:
-        if prefix in _vendor_cache:
-            return _vendor_cache[prefix]
-        vendor = None
-        if _mac_lookup is not None:
-            try:
-                vendor = _mac_lookup.lookup(mac)
-            except Exception:
-                vendor = None
-        _vendor_cache[prefix] = vendor or "Unknown"
-        return _vendor_cache[prefix]
+    if len(b) == 12 and b":" not in b:
+        b = b"%s:%s:%s:%s:%s:%s" % _MAC_SPLIT.unpack(b)
+    try:
+        oui = int(b[0:8].replace(b":", b""), 16) if b[2] == b[5] == 58 else None  # 58 == ord(":")
+    except (ValueError, IndexError):
+        oui = None
+    return b.decode("ascii"), oui
+
 
+def _lookup_vendor(mac: str) -> str:
+    # Runs on the VendorLookup thread only
+    global _mac_lookup
+    if _mac_lookup is None:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        _mac_lookup = MacLookup()
+    return _mac_lookup.lookup(mac)
 
-@dataclass
+
+@lru_cache(maxsize=8192)
+def _cached_vendor_for_oui(oui: int) -> str:
+    # Only "not found" is cached; any other failure propagates, and
+    # lru_cache does not memoize exceptions, so the OUI is retried later
+    mac = ":".join(f"{b:02X}" for b in oui.to_bytes(3, "big")) + ":00:00:00"
+    try:
+        return _vendor_executor.submit(_lookup_vendor, mac).result() or "Unknown"
+    except KeyError:  # VendorNotFoundError subclasses KeyError
+        return "Unknown"
+
+
+def _vendor_for_oui(oui: int) -> str:
+    if _vendor_executor is None:
+        return "Unknown"
+    try:
+        return _cached_vendor_for_oui(oui)
+    except Exception as e:
+        print(f"[Vendor] lookup failed: {e}")
+        return "Unknown"
+
+
+class _RWLock:
+    """
+    Minimal reader-writer lock: any number of readers, or a single writer.
+    Writers are preferred once waiting so a steady stream of snapshots
+    cannot starve scanner updates. Not reentrant.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).astimezone().isoformat()
+
+
+def _strength_key(rec: "DeviceRecord") -> int:
+    # Strongest (closest to 0) first; None signals go to the bottom
+    return -(rec.rssi if rec.rssi is not None else -9999)
+
+
+@dataclass(eq=False)  # identity equality: SortedKeyList.remove must find this exact record
 class DeviceRecord:
     type: str                    # "wifi" | "ble"
     mac: str
@@ -52,71 +140,184 @@ class DeviceRecord:
     rssi: Optional[int] = None   # dBm (negative)
     first_seen: float = field(default_factory=time.time)
     last_seen: float = field(default_factory=time.time)
-    history: deque = field(default_factory=lambda: deque(maxlen=300))  # of int RSSI dBm
+    first_seen_iso: str = ""     # cached local-time ISO-8601 of first_seen
+    last_seen_iso: str = ""      # cached local-time ISO-8601 of last_seen
+    history: np.ndarray = field(default_factory=lambda: np.zeros(300, dtype=np.int8))  # ring buffer of RSSI dBm
+    hist_pos: int = 0            # next write slot in history
+    hist_len: int = 0            # number of valid samples in history
 
 
 class DeviceStore:
-    def __init__(self, history_len: int = 60):
-        self._lock = threading.RLock()
+    def __init__(self, history_len: int = 60, log_path: Optional[str] = None):
+        self._lock = _RWLock()
         self._records: Dict[str, DeviceRecord] = {}
+        # Per-type indexes kept ordered by signal strength as updates arrive,
+        # so snapshot() never has to sort
+        self._wifi_sorted = SortedKeyList(key=_strength_key)
+        self._ble_sorted = SortedKeyList(key=_strength_key)
         self._history_len = history_len
+        self._version = 0  # bumped on every batch that changes the store
+        # Append-only NDJSON observation log, opened once
+        self._log_fd: Optional[int] = None
+        if log_path:
+            self._log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
 
     def update(self, *, dev_type: str, mac: str, name: Optional[str], rssi: Optional[int], ssid: Optional[str] = None):
-        mac = _normalize_mac(mac)
+        self.update_many([(dev_type, mac, (name or ssid) if dev_type == "wifi" else name, rssi)])
+
+    def update_many(self, records: List[tuple]):
+        """
+        Ingest a batch of (dev_type, mac, name, rssi) observations under a single
+        write lock. All records in the batch share one last_seen timestamp.
+        """
+        now = time.time()
+        now_iso = _iso(now)
+        logged = []
+        with self._lock.write():
+            changed = False
+            for dev_type, mac, name, rssi in records:
+                rec = self._ingest(dev_type, mac, name, rssi, now, now_iso)
+                if rec is None:
+                    continue
+                changed = True
+                if self._log_fd is not None:
+                    logged.append({
+                        "ts": now,
+                        "type": rec.type,
+                        "mac": rec.mac,
+                        "name": rec.name or rec.ssid,
+                        "vendor": rec.vendor,
+                        "rssi": rec.rssi,
+                    })
+            if changed:
+                self._version += 1
+
+        # --- append this batch's observations to the log ---
+        if logged:
+            try:
+                os.write(self._log_fd, b"".join(orjson.dumps(e) + b"\n" for e in logged))
+            except OSError as e:
+                print(f"[LOG] failed to write log: {e}")
+
+    @property
+    def version(self) -> int:
+        """Monotonic counter that changes whenever snapshot() would."""
+        with self._lock.read():
+            return self._version
+
+    def _ingest(self, dev_type: str, mac: str, name: Optional[str], rssi: Optional[int], now: float, now_iso: str) -> Optional[DeviceRecord]:
+        # Caller must hold the write lock
+        mac, oui = _normalize_mac(mac)
         if not mac or rssi is None:
-            return
-        with self._lock:
-            rec = self._records.get(mac)
-            if rec is None:
-                rec = DeviceRecord(type=dev_type, mac=mac)
-                rec.history = deque(maxlen=self._history_len)
-                self._records[mac] = rec
+            return None
+        rssi = int(rssi)
+        rec = self._records.get(mac)
+        if rec is None:
+            # Vendor is resolved once, when the device is first seen
+            vendor = _vendor_for_oui(oui) if oui is not None else "Unknown"
+            rec = DeviceRecord(type=dev_type, mac=mac, vendor=vendor, rssi=rssi,
+                               first_seen=now, first_seen_iso=now_iso,
+                               history=np.zeros(self._history_len, dtype=np.int8))
+            self._records[mac] = rec
+            self._sorted_for(dev_type).add(rec)
+        elif rec.rssi != rssi or rec.type != dev_type:
+            # Key inputs are changing: re-slot the record in its index
+            self._sorted_for(rec.type).remove(rec)
             rec.type = dev_type
-            rec.mac = mac
-            if dev_type == "wifi":
-                rec.ssid = name or ssid
-                rec.name = None
-            else:
-                rec.name = name
-            rec.vendor = rec.vendor or _vendor_for(mac)
-            rec.rssi = int(rssi)
-            rec.last_seen = time.time()
-            rec.history.append(int(rssi))
-            
-            # --- save snapshot after each update ---
-        try:
-            from app import LOG_FILE  # import global filename
-            import json
-            snapshot = self.snapshot()
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                json.dump(snapshot, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"[LOG] failed to write log: {e}")
+            rec.rssi = rssi
+            self._sorted_for(dev_type).add(rec)
+        if dev_type == "wifi":
+            rec.ssid = name
+            rec.name = None
+        else:
+            rec.name = name
+        rec.last_seen = now
+        rec.last_seen_iso = now_iso
+        n = len(rec.history)
+        rec.history[rec.hist_pos] = max(-128, min(127, rssi))
+        rec.hist_pos = (rec.hist_pos + 1) % n
+        rec.hist_len = min(rec.hist_len + 1, n)
+        return rec
+
+    def _sorted_for(self, dev_type: str) -> SortedKeyList:
+        return self._wifi_sorted if dev_type == "wifi" else self._ble_sorted
 
     def snapshot(self) -> List[dict]:
-        with self._lock:
-            out = []
-            for rec in self._records.values():
-                out.append({
-                    "type": rec.type,
-                    "mac": rec.mac,
-                    "name": rec.name,
-                    "ssid": rec.ssid,
-                    "vendor": rec.vendor,
-                    "rssi": rec.rssi,
-                    "first_seen": rec.first_seen,
-                    "last_seen": rec.last_seen,
-                    "history": list(rec.history),
-                })
-            # Sort: Wi-Fi first, then BLE; within each, strongest (closest to 0) first
-            def sort_key(d):
-                t = 0 if d["type"] == "wifi" else 1
-                rssi = d.get("rssi")
-                # None signals go to the bottom
-                strength = -(rssi if (isinstance(rssi, int) or isinstance(rssi, float)) else -9999)
-                return (t, -strength)
-            out.sort(key=sort_key)
-            return out
+        with self._lock.read():
+            # Wi-Fi first, then BLE; each index is already strongest-first
+            return [{
+                "type": rec.type,
+                "mac": rec.mac,
+                "name": rec.name,
+                "ssid": rec.ssid,
+                "vendor": rec.vendor,
+                "rssi": rec.rssi,
+                "first_seen": rec.first_seen,
+                "last_seen": rec.last_seen,
+                "first_seen_iso": rec.first_seen_iso,
+                "last_seen_iso": rec.last_seen_iso,
+                # Chronological copy of the ring buffer (oldest first)
+                "history": np.concatenate((rec.history[rec.hist_pos:rec.hist_len], rec.history[:rec.hist_pos])),
+            } for rec in chain(self._wifi_sorted, self._ble_sorted)]
+
+
+# -------------------- Shared scanner event loop --------------------
+# Both scanners run as coroutines on one asyncio loop in a single daemon
+# thread; blocking driver calls are pushed to the default executor.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_batchers: Dict[DeviceStore, "_UpdateBatcher"] = {}
+
+
+def _scanner_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="ScannerLoop", daemon=True).start()
+        return _loop
+
+
+class _UpdateBatcher:
+    """
+    Buffers (dev_type, mac, name, rssi) observations and hands them to the
+    store via update_many every `interval` seconds, or sooner once
+    `max_items` are queued. Must only be used from the scanner loop thread.
+    """
+    def __init__(self, store: DeviceStore, interval: float = 0.1, max_items: int = 64):
+        self._store = store
+        self._interval = interval
+        self._max_items = max_items
+        self._pending: List[tuple] = []
+
+    def add(self, record: tuple):
+        self._pending.append(record)
+        if len(self._pending) >= self._max_items:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            batch = self._pending
+            self._pending = []
+            self._store.update_many(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Store] batch update error: {e}")
+
+
+def _batcher_for(store: DeviceStore) -> _UpdateBatcher:
+    loop = _scanner_loop()
+    with _loop_lock:
+        batcher = _batchers.get(store)
+        if batcher is None:
+            batcher = _batchers[store] = _UpdateBatcher(store)
+            asyncio.run_coroutine_threadsafe(batcher.run(), loop)
+        return batcher
 
 
 # -------------------- Wi-Fi Scanner (pywifi) --------------------
@@ -137,7 +338,8 @@ def fix_mojibake(ssid: str) -> str:
 
 def start_wifi_scanner(store: DeviceStore, interval_sec: int = 5):
     """
-    Runs in a background thread. Every interval, triggers a scan and ingests results.
+    Schedules the Wi-Fi scan coroutine on the shared scanner loop. Every
+    interval, triggers a scan and ingests results through the batched store path.
     Notes:
       - pywifi 'signal' should be dBm, but on some platforms it may be 0-100 quality.
         We heuristically convert quality -> dBm via (quality/2) - 100.
@@ -159,10 +361,11 @@ def start_wifi_scanner(store: DeviceStore, interval_sec: int = 5):
             return int(round((x / 2.0) - 100))  # 0 -> -100 dBm, 100 -> -50 dBm
         return int(x)  # already dBm (likely negative)
 
-    def worker():
+    async def wifi_loop():
+        loop = asyncio.get_running_loop()
+        batcher = _batcher_for(store)
         try:
-            wifi = PyWiFi()
-            ifaces = wifi.interfaces()
+            ifaces = await loop.run_in_executor(None, lambda: PyWiFi().interfaces())
             if not ifaces:
                 print("[WiFi] No wireless interfaces found.")
                 return
@@ -171,10 +374,10 @@ def start_wifi_scanner(store: DeviceStore, interval_sec: int = 5):
 
             while True:
                 try:
-                    iface.scan()
+                    await loop.run_in_executor(None, iface.scan)
                     # Small settle delay; Windows often needs a couple seconds
-                    time.sleep(2.5)
-                    results = iface.scan_results()
+                    await asyncio.sleep(2.5)
+                    results = await loop.run_in_executor(None, iface.scan_results)
                     for cell in results:
                         ssid = getattr(cell, "ssid", None)
                         ssid = fix_mojibake(ssid) if ssid else None
@@ -186,21 +389,29 @@ def start_wifi_scanner(store: DeviceStore, interval_sec: int = 5):
                         if dbm is None:
                             continue
                         # Hidden SSIDs appear as empty strings
-                        store.update(dev_type="wifi", mac=bssid, name=ssid or "(hidden)", rssi=dbm)
+                        batcher.add(("wifi", bssid, ssid or "(hidden)", dbm))
                 except Exception as e:
                     print(f"[WiFi] scan error: {e}")
-                time.sleep(interval_sec)
+                await asyncio.sleep(interval_sec)
         except Exception as e:
             print(f"[WiFi] fatal: {e}")
 
-    t = threading.Thread(target=worker, name="WiFiScanner", daemon=True)
-    t.start()
+    asyncio.run_coroutine_threadsafe(wifi_loop(), _scanner_loop())
 
 
 # -------------------- BLE Scanner (bleak) --------------------
+def _bleak_reports_adv_rssi() -> bool:
+    """One-time probe: does this Bleak's AdvertisementData carry rssi?"""
+    try:
+        from bleak.backends.scanner import AdvertisementData
+    except Exception:
+        return False
+    return "rssi" in getattr(AdvertisementData, "_fields", ())
+
+
 def start_ble_scanner(store: DeviceStore):
     """
-    Starts a thread that runs an asyncio loop with a continuous BleakScanner.
+    Schedules a continuous BleakScanner on the shared scanner loop.
     """
     try:
         from bleak import BleakScanner
@@ -209,8 +420,19 @@ def start_ble_scanner(store: DeviceStore):
         return
 
     async def ble_loop():
-        # Callback compatible across Bleak versions
-        def on_adv(device, advertisement_data=None):
+        # Adverts are handed to the store in batches, so the write lock is
+        # taken ~10x/s instead of once per advert
+        batcher = _batcher_for(store)
+
+        # Bleak >= 0.19 reports rssi on AdvertisementData (a NamedTuple), so the
+        # hot path can read attributes directly; older releases keep the
+        # defensive getattr probing below.
+        def on_adv_new(device, advertisement_data):
+            batcher.add(("ble", device.address,
+                         advertisement_data.local_name or device.name or "(unknown)",
+                         advertisement_data.rssi))
+
+        def on_adv_old(device, advertisement_data=None):
             try:
                 name = None
                 rssi = None
@@ -224,10 +446,12 @@ def start_ble_scanner(store: DeviceStore):
                     name = getattr(device, "name", None) or "(unknown)"
                 mac = getattr(device, "address", None)
                 if mac and rssi is not None:
-                    store.update(dev_type="ble", mac=mac, name=name, rssi=int(rssi))
+                    batcher.add(("ble", mac, name, int(rssi)))
             except Exception as e:
                 print(f"[BLE] adv parse error: {e}")
 
+        on_adv = on_adv_new if _bleak_reports_adv_rssi() else on_adv_old
+
         # Try both registration styles
         try:
             scanner = BleakScanner(detection_callback=on_adv)
@@ -243,14 +467,12 @@ def start_ble_scanner(store: DeviceStore):
                 await asyncio.sleep(1.0)
         finally:
             await scanner.stop()
+            batcher.flush()
 
-    def run():
+    async def run():
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(ble_loop())
+            await ble_loop()
         except Exception as e:
             print(f"[BLE] loop error: {e}")
 
-    t = threading.Thread(target=run, name="BLEScanner", daemon=True)
-    t.start()
+    asyncio.run_coroutine_threadsafe(run(), _scanner_loop())
@@ -367,7 +367,8 @@ function startPolling(immediate = true) {
 async function poll() {
   if (!polling) return; // skip if paused
   try {
-    const res = await fetch("/api/devices", { cache: "no-store" });
+    // "no-cache" revalidates with If-None-Match; an unchanged store answers 304
+    const res = await fetch("/api/devices", { cache: "no-cache" });
     const data = await res.json();
     rawDevices = data.devices || [];
 